@@ -1,32 +1,156 @@
 #!/usr/bin/env python
 
 import configparser
+import datetime
 import json
 import requests
 import sqlite3
 import logging
+import os
+from contextlib import closing, suppress
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-config = configparser.ConfigParser()
-config.read('config.ini')
 
+class WebhookRetry(Retry):
+    """
+    Retry policy that honours a Retry-After header only on 429 responses.
+
+    urllib3 otherwise also retries 413 and 503 responses carrying Retry-After,
+    which would re-send a webhook post that may already have been accepted.
+    """
+    RETRY_AFTER_STATUS_CODES = frozenset([429])
+
+
+# One pooled session for the holiday API and the Slack webhook
+session = requests.Session()
+# The webhook POST isn't idempotent: only retry when the connection failed or the request was
+# rejected with 429, never after a read timeout or server error where it may have been accepted
+webhook_retries = WebhookRetry(total=3, read=0, backoff_factor=2, status_forcelist=[429], allowed_methods={'POST'})
+session.mount('https://', HTTPAdapter(max_retries=webhook_retries))
+holiday_retries = Retry(total=3, backoff_factor=2, status_forcelist=[429, 500, 502, 503, 504], allowed_methods={'GET'})
+session.mount('https://date.nager.at/', HTTPAdapter(max_retries=holiday_retries))
+
+DATABASE = os.environ.get('COTD_DB', 'user.db')
+HOLIDAY_CACHE = os.path.join(os.path.dirname(os.path.abspath(DATABASE)), 'holiday_cache.json')
+
+# Today's catcher if already chosen, otherwise the available user not chosen for the longest time
+FIND_CATCHER_SQL = """
+    select mail, 1 as already_chosen
+      from user
+     where last_chosen = :today
+    union all
+    select * from (
+        select mail, 0
+          from user
+         where weekdays like :weekday
+           and ((vacation_start is null or vacation_end is null)
+                or (:today < vacation_start or :today > vacation_end))
+         order by last_chosen asc
+         limit 1
+    )
+    order by already_chosen desc
+    limit 1
+"""
+MARK_CHOSEN_SQL = "update user set last_chosen = :today where mail = :mail"
+
+
+@lru_cache(maxsize=1)
+def get_config():
+    """
+    Reads `config.ini` on first use.
+
+    :return: The parsed configuration
+    """
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    return config
+
+
+def read_holiday_cache(today):
+    """
+    Reads the cached holiday status for the given day.
+
+    :param today: The day in ISO format
+    :return: The cached status, or None if there is no entry for that day
+    """
+    try:
+        with open(HOLIDAY_CACHE) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # Anything unexpected in the file counts as a miss
+    if not isinstance(cache, dict) or cache.get('date') != today or not isinstance(cache.get('holiday'), bool):
+        return None
+    return cache['holiday']
+
+
+def write_holiday_cache(today, holiday):
+    """
+    Stores the holiday status for the given day, replacing any older entry.
 
-def is_holiday():
+    :param today: The day in ISO format
+    :param holiday: Whether the day is a public holiday
+    """
+    try:
+        # Write to a temporary file and swap it in, so overlapping runs never see a partial file
+        # Created through open() rather than mkstemp so the file gets the usual umask permissions
+        tmp = f'{HOLIDAY_CACHE}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'x') as f:
+                json.dump({'date': today, 'holiday': holiday}, f)
+            os.replace(tmp, HOLIDAY_CACHE)
+        except OSError:
+            with suppress(FileNotFoundError):
+                os.unlink(tmp)
+            raise
+    except OSError as e:
+        logging.warning('Failed to write holiday cache: %s', e)
+
+
+def is_holiday(today):
     """
     Checks if today is a public holiday in Germany.
 
+    The answer is cached on disk for the rest of the day, so repeated runs
+    don't have to query the holiday API again.
+
+    :param today: Today's date
     :return: True if today is a public holiday, False otherwise
     """
-    try:
-        response = requests.get('https://date.nager.at/Api/v2/IsTodayPublicHoliday/DE', timeout=1)
-        if response.status_code == 200:
-            logging.info('Holiday detected')
-        return response.status_code == 200
-    except requests.exceptions.RequestException as e:
-        logging.error('Failed to check holiday status: %s', e)
-        return False
+    iso_today = today.isoformat()
+    holiday = read_holiday_cache(iso_today)
+    if holiday is None:
+        try:
+            # Only the status code matters, so don't download the body
+            with session.get('https://date.nager.at/Api/v2/IsTodayPublicHoliday/DE', timeout=1, stream=True) as response:
+                status = response.status_code
+        except requests.exceptions.RequestException as e:
+            logging.error('Failed to check holiday status: %s', e)
+            return False
+
+        holiday = status == 200
+        # The API answers 200 for holidays and 204 otherwise; don't cache errors
+        if status in (200, 204):
+            write_holiday_cache(iso_today, holiday)
+
+    if holiday:
+        logging.info('Holiday detected')
+    return holiday
+
+
+def is_weekend(today):
+    """
+    Checks if today is a Saturday or a Sunday.
+
+    :param today: Today's date
+    :return: True if today is on a weekend, False otherwise
+    """
+    return today.weekday() >= 5
 
 
 def trigger_slack(mail):
@@ -44,63 +168,69 @@ def trigger_slack(mail):
     trigger_slack('user@example.com')
     ```
 
-    Note: This method requires the `config` object to be properly configured with the Slack webhook URL.
+    Note: This method requires `config.ini` to be properly configured with the Slack webhook URL.
     """
     try:
-        data = {'uid': mail}
-        headers = {'Content-type': 'application/json'}
-        response = requests.post(config.get('slack', 'webhook'), headers=headers, data=json.dumps(data), timeout=1)
-        if response.status_code == 200:
+        response = session.post(get_config().get('slack', 'webhook'), json={'uid': mail}, timeout=1)
+        if response.ok:
             logging.info("Chosen Catcher: %s", mail)
         else:
-            logging.warn("Webhook returned: %d (%s)", response.status_code, response.json)
+            logging.warning("Webhook returned: %d (%s)", response.status_code, response.content[:512])
     except requests.exceptions.RequestException as e:
         logging.error('Failed to trigger Slack notification: %s', e)
 
-def find_next_catcher():
+def get_db_connection():
+    """
+    Opens the user database in WAL mode with relaxed syncing.
+
+    The connection runs in autocommit mode, callers start their transactions
+    explicitly.
+
+    :return: The database connection
+    """
+    conn = sqlite3.connect(DATABASE, isolation_level=None)
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return conn
+
+
+def find_next_catcher(today):
     """
     This method `find_next_catcher` is used to retrieve the email address
     of the next user who is available.
     The method retrieves the email address from a database table based
     on specific conditions.
 
+    :param today: Today's date
     :return: The email address of the next available user or None
     """
-    conn = sqlite3.connect("user.db")
-    cur = conn.cursor()
+    # The weekdays column counts from Sunday = 0
+    weekday = today.isoweekday() % 7
+    iso_today = today.isoformat()
+    with closing(get_db_connection()) as conn, conn:
+        # Take the write lock up front, a concurrent run must not pick a second catcher
+        conn.execute('BEGIN IMMEDIATE')
+        cur = conn.cursor()
 
-    cur.execute("""
-        select mail 
-          from user
-         where last_chosen = date()
-    """)
-
-    result = cur.fetchone()
-    if result is None:
-        cur.execute("""
-            select mail 
-                from user 
-            where weekdays like strftime('%%%w%%','now')
-                and ((vacation_start is null or vacation_end is null) 
-                    or (date() < vacation_start or date() > vacation_end))
-            order by last_chosen asc
-            limit 1
-        """)
+        cur.execute(FIND_CATCHER_SQL, {'today': iso_today, 'weekday': f'%{weekday}%'})
 
         result = cur.fetchone()
-        if result is not None:
-            cur.execute("update user set last_chosen = date() where mail = ?", result)
-            conn.commit()
+        if result is not None and not result[1]:
+            cur.execute(MARK_CHOSEN_SQL, {'today': iso_today, 'mail': result[0]})
 
-    conn.close()
     return None if result is None else result[0]
 
 
 def main():
-    if is_holiday():
+    today = datetime.date.today()
+    if is_weekend(today) or is_holiday(today):
         return
 
-    mail = find_next_catcher()
+    mail = find_next_catcher(today)
     trigger_slack(mail)
 
 
@@ -1,8 +1,10 @@
 #!/usr/bin/env bash
 
-sqlite3 user.db < setup.sql
+db="${COTD_DB:-user.db}"
 
-test -f setup-user.sql && sqlite3 user.db < setup-user.sql
+sqlite3 "${db}" < setup.sql
 
-ctab="30 7 * * 1-5	cd ${PWD} ; ./catcher.py"
+test -f setup-user.sql && sqlite3 "${db}" < setup-user.sql
+
+ctab="30 7 * * 1-5	cd ${PWD} ; COTD_DB=${db} ./catcher.py"
 (crontab -u "$(whoami)" -l; echo "${ctab}" ) | crontab -u "$(whoami)" -
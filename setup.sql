@@ -9,3 +9,5 @@ CREATE TABLE IF NOT EXISTS user (
         vacation_end   DATE
 );
 
+-- Index: idx_user_last_chosen
+CREATE INDEX IF NOT EXISTS idx_user_last_chosen ON user(last_chosen);